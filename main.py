@@ -5,7 +5,7 @@ from langchain.memory import ConversationBufferMemory
 from langchain_community.chat_models import ChatOpenAI
 from langchain_community.llms import OpenAI
 # task_manager.py
-from task_manager import TaskManager, convert_langchain_tools, EmptyCallbackHandler
+from task_manager import TaskManager, iter_langchain_tools, EmptyCallbackHandler
 # prompt.py - recycled
 from prompt import AGENT_PREFIX, AGENT_FORMAT_INSTRUCTIONS, AGENT_SUFFIX
 # tools/
@@ -13,6 +13,7 @@ from tools import TOOLS
 
 # parse arguments
 from argparse import ArgumentParser
+import asyncio
 parser = ArgumentParser()
 parser.add_argument('--goal', '-g', help='Goal for task manager to complete.', required=True)
 parser.add_argument('--tui', help='Use the Terminal User Interface. Default False.', action='store_true', default=False)
@@ -23,6 +24,8 @@ parser.add_argument('--temperature', help='Temperature for chat model. Default 0
 parser.add_argument('--tools', '-t', help=f'Comma separated list of tools to use (from: {", ".join(TOOLS.keys())}) . Default: DDGSearch,Shell', default='DDGSearch,Shell')
 parser.add_argument('--tool-args', help="A dictionary containing kwargs that will be passed to tools as they are initialized. Default: {'Shell': {'confirm_before_exec': True}}", type=dict, default={'Shell': {'confirm_before_exec': True}})
 parser.add_argument('--use-smart-combine', help='Uses smart combination when formatting info for agents. Default False. Use this if your prompts are getting too large.', action='store_true', default=False)
+parser.add_argument('--checkpoint', help='Save results so far to the result file at most every N seconds, so a crash does not lose them. Default disabled.', type=float, default=None)
+parser.add_argument('--parallel', help='Max number of independent tasks to run at the same time. Default 1. Whether tasks are independent is a heuristic (keywords, then a quick LLM check), so check the batch before continuing.', type=int, default=1)
 parser.add_argument('--include-completed-tasks', help='Include completed tasks in the prompt for agents. Default True. Turn this off for less tokens used.', action='store_false', default=True)
 args = parser.parse_args()
 
@@ -31,12 +34,6 @@ llm = ChatOpenAI(
     temperature=args.temperature, 
     model_name=args.model
 )
-# memory for agent
-memory = ConversationBufferMemory(
-    memory_key="chat_history", 
-    output_key='output', 
-    return_messages=True
-)
 # tools i wrote for the agent, can be used with any langchain program, from ./tools/
 tools = []
 for tool in args.tools.split(','):
@@ -49,28 +46,38 @@ for tool in args.tools.split(','):
 # create an instance of TaskManager
 taskman = TaskManager(
     args.goal, # goal
-    convert_langchain_tools(tools), # list of dicts of tools
+    iter_langchain_tools(tools), # dicts of tools, only converted if the tools are needed in a prompt
     OpenAI(temperature=0), # llm for taskmanager
     persist=args.persist, # i want to persist data
     allow_repeat_tasks=args.repeat, # so it doesn't get stuck in a loop
+    checkpoint_interval=args.checkpoint, # save partial results as we go
 )
 
 # now the agent for doing tasks
-agent = initialize_agent(
-    tools, # list of BaseTool objects
-    llm, # our chat model
-    memory=memory, # the memory we created
-    agent = AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION, # const
-    agent_kwargs={
-        'prefix': AGENT_PREFIX,
-        'format_instructions': AGENT_FORMAT_INSTRUCTIONS,
-        'suffix': AGENT_SUFFIX
-    },
-    callbacks=[EmptyCallbackHandler()], # so that we can dynamically add with taskman.init_agent
-    verbose=True # so we can see when it runs each tool
-)
-# this lets us save tool outputs
-taskman.init_agent(agent)
+def make_agent():
+    # memory for agent
+    memory = ConversationBufferMemory(
+        memory_key="chat_history", 
+        output_key='output', 
+        return_messages=True
+    )
+    agent = initialize_agent(
+        tools, # list of BaseTool objects
+        llm, # our chat model
+        memory=memory, # the memory we created
+        agent = AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION, # const
+        agent_kwargs={
+            'prefix': AGENT_PREFIX,
+            'format_instructions': AGENT_FORMAT_INSTRUCTIONS,
+            'suffix': AGENT_SUFFIX
+        },
+        callbacks=[EmptyCallbackHandler()], # so that we can dynamically add with taskman.init_agent
+        verbose=True # so we can see when it runs each tool
+    )
+    # this lets us save tool outputs
+    taskman.init_agent(agent)
+    return agent
+agent = make_agent()
 
 # lightweight example task loop
 def main():
@@ -79,6 +86,18 @@ def main():
             if taskman.ensure_goal_complete(): # makes sure we're done
                 break
             continue # if not complete, more tasks will be added
+        if args.parallel > 1:
+            tasks = taskman.next_task_batch(args.parallel) # tasks that can run at the same time
+            print('\n\nNext tasks:', tasks)
+            if input('Continue? [Y]es/[n]o: ').lower().startswith('n'):
+                continue # skips tasks
+            asyncio.run(taskman.arun_tasks(
+                tasks,
+                lambda prompt: make_agent().arun(prompt), # a new agent per task, so their memories don't mix
+                smart_combine=args.use_smart_combine,
+                include_completed_tasks=args.include_completed_tasks
+            )) # also refines
+            continue
         task = taskman.current_tasks.pop(0) # get first task
         print('\n\nNext task:', task)
         cont = input('Continue? [Y]es/[n]o/[e]dit: ').lower()
@@ -3,57 +3,314 @@ from langchain.llms.base import BaseLLM
 from langchain.tools import BaseTool
 from code import InteractiveConsole
 from langchain.llms import OpenAI
+from operator import attrgetter
+from functools import lru_cache
+from string import Template
+import threading
+import tempfile
+import hashlib
+import asyncio
+import base64
+import atexit
+import mmap
 import json
+import time
+import sys
 import os
+import re
+
+try:
+    # optional, faster JSON (de)serialization
+    import orjson
+    _dumps = lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _dumps = lambda obj: json.dumps(obj).encode()
+    _loads = json.loads
+
+try:
+    # optional, used to repair bad JSON from the LLM without asking it to fix it
+    import json_repair
+except ImportError:
+    json_repair = None
+
+try:
+    # optional, only needed for semantic_cache=True
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+_get_tool_info = attrgetter('name', 'description')
+_DEPENDENT_TASK_RE = re.compile(r'\b(then|after|previous|above|results?|found|identified|discovered|these|those|them|based on|using the)\b', re.I) # tasks that probably need earlier results
 
 class EmptyCallbackHandler(BaseCallbackHandler):
-    pass
+    run_inline = True # so the TaskManager callbacks added by `init_agent` aren't run in a thread pool when agents run async
+
+def _intern_tasks(tasks: list) -> list:
+    """Interns task strings, as the same tasks come back from the LLM over and over (so comparing them is just an identity check)."""
+    return [sys.intern(task) if type(task) == str else task for task in tasks]
+
+def _write_atomic(fn: str, data: bytes):
+    """Writes data to a temporary file, then moves it to fn, so a crash mid-write can't corrupt fn."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fn) or '.', prefix=os.path.basename(fn) + '.', suffix='.tmp') # unique, so concurrent writes can't mix
+    try:
+        with open(fd, 'wb', buffering=1 << 20) as f:
+            f.write(data)
+        os.replace(tmp, fn)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+@lru_cache
+def _result_filename(goal: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_-]', '_', goal)[:120] + '.result.txt' # no slashes etc., and short enough for any filesystem
 
 def save_to_file(goal: str, result: dict):
     """Saves the results dict (second argument) to a file ending in '.result.txt' with the name set to the goal (first argument)"""
-    fn = goal.replace(' ','_') + '.result.txt'
+    fn = _result_filename(goal)
     print(f'saving final result to {fn}')
-    with open(fn, 'w') as f:
-        json.dump(result, f)
+    _write_atomic(fn, _dumps(result))
 
 def convert_langchain_tools(tools: list[BaseTool]) -> list[dict]:
     """Converts a list of BaseTools (used in langchain) to a list of dictionaries containing the keys: 'name', and 'description'."""
-    return [{'name': tool.name, 'description': tool.description} for tool in tools if type(tool) == BaseTool]
+    return [{'name': name, 'description': description} for name, description in map(_get_tool_info, tools)]
+
+def iter_langchain_tools(tools: list[BaseTool]):
+    """Same as `convert_langchain_tools`, but yields each dict instead of building a list."""
+    return ({'name': name, 'description': description} for name, description in map(_get_tool_info, tools))
+
+def _extract_json(text: str) -> str:
+    """
+    Returns the first {...} object in text (e.g. without ```json fences or any prose around it), by counting braces outside of strings.
+    If the object is never closed, returns everything from the first '{'. Returns text as is if it has no '{'.
+    """
+    start = text.find('{')
+    if start == -1:
+        return text
+    depth = 0
+    in_str = escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_str:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+def _iter_json_members(chunks):
+    """
+    Incrementally parses a JSON object from an iterable of text chunks, yielding (key, value) for each top-level member as soon as it is complete.
+    Anything before the opening '{' or after the closing '}' is ignored. Raises json.JSONDecodeError if the chunks end before the object does.
+    """
+    buf = ''
+    pos = depth = 0
+    start = None # where the current top-level member starts
+    in_str = escaped = False
+    for chunk in chunks:
+        buf += chunk
+        for i in range(pos, len(buf)):
+            c = buf[i]
+            if depth == 0: # skip any text before the object
+                if c == '{':
+                    depth, start = 1, i + 1
+            elif in_str:
+                if escaped:
+                    escaped = False
+                elif c == '\\':
+                    escaped = True
+                elif c == '"':
+                    in_str = False
+            elif c == '"':
+                in_str = True
+            elif c in '{[':
+                depth += 1
+            elif c in '}]':
+                depth -= 1
+                if depth == 0:
+                    if buf[start:i].strip():
+                        yield from _loads('{' + buf[start:i] + '}').items()
+                    return
+            elif c == ',' and depth == 1:
+                yield from _loads('{' + buf[start:i] + '}').items()
+                start = i + 1
+        pos = len(buf)
+    raise json.JSONDecodeError('stream ended before the JSON object was closed', buf, len(buf))
+
+class CachingLLM(object):
+    """
+    Wraps an LLM so that similar prompts don't need another round-trip.
+
+    If semantic is True (requires `sentence-transformers`), calls that pass `kind` and `match` are looked up by embedding `match`, and a previous
+    response of the same kind whose match text has a cosine similarity >= threshold is reused. `match` should only contain what changes between
+    calls (not the prompt template), otherwise every prompt looks the same, and be short: anything longer than the embedder's max sequence length
+    (256 tokens for `EMBED_MODEL`) isn't matched at all. Exact repeats are handled by `TaskManager._llm` before reaching this.
+    """
+    EMBED_MODEL: str = 'sentence-transformers/all-MiniLM-L6-v2'
+    EMBED_DIM: int = 384
+
+    def __init__(self, llm: BaseLLM, threshold: float = 0.92, semantic: bool = False, embedder = None):
+        """
+        :param llm: BaseLLM - LLM instance from langchain.llms
+
+        :kwarg threshold: float - defaults to 0.92, minimum cosine similarity for a semantic cache hit
+        :kwarg semantic: bool - defaults to False, if True will also match similar (not just identical) prompts
+        :kwarg embedder: SentenceTransformer - defaults to None (loads `EMBED_MODEL`), pass another CachingLLM's embedder to share it
+        """
+        self.llm = llm
+        self.threshold = threshold
+        self.caches = {} # kind: [keys, responses, embeddings], so e.g. a refine can only match another refine
+        self.embedder = None
+        self.on_store = None # called with (kind, key, response, embedding) for each new entry, key is a hash of match (see `_key`)
+        if semantic:
+            if SentenceTransformer is None:
+                raise ImportError('semantic caching requires the sentence-transformers library. Please install it with `pip install sentence-transformers`')
+            self.embedder = embedder or SentenceTransformer(self.EMBED_MODEL)
+
+    @property
+    def deterministic(self) -> bool:
+        return getattr(self.llm, 'temperature', None) == 0
+
+    def _embed(self, match: str):
+        """Returns the embedding of match, or None if semantic caching is off, or match is too long to embed without being truncated (and so can't be compared reliably)."""
+        if self.embedder is None or match is None:
+            return None
+        if len(self.embedder.tokenizer(match)['input_ids']) > self.embedder.max_seq_length:
+            return None
+        return self.embedder.encode([match], normalize_embeddings=True)[0].astype(np.float32)
+
+    @staticmethod
+    def _key(match: str) -> str:
+        """Entries are only ever looked up by embedding, so they're saved under a short hash of match rather than the (long) prompt."""
+        return hashlib.blake2b(match.encode(), digest_size=16).hexdigest()
+
+    def _lookup(self, kind: str, emb) -> str:
+        if (cache := self.caches.get(kind)):
+            keys, responses, embeddings = cache
+            scores = emb @ embeddings.T
+            best = int(scores.argmax())
+            if scores[best] >= self.threshold:
+                return responses[best]
+
+    def _store(self, kind: str, match: str, resp: str, emb):
+        keys, responses, embeddings = self.caches.setdefault(kind, [[], [], np.empty((0, self.EMBED_DIM), dtype=np.float32)])
+        keys.append(key := self._key(match))
+        responses.append(resp)
+        self.caches[kind][2] = np.vstack([embeddings, emb])
+        if self.on_store:
+            self.on_store(kind, key, resp, emb)
+
+    def __call__(self, prompt: str, kind: str = None, match: str = None, **kwargs) -> str:
+        """
+        :param prompt: str - full prompt to send to the LLM
+
+        :kwarg kind: str - defaults to None, the type of prompt (e.g. "refine"), only responses of the same kind are reused
+        :kwarg match: str - defaults to None (no semantic matching), the part of the prompt that changes between calls of this kind
+        """
+        if (emb := self._embed(match)) is not None and (resp := self._lookup(kind, emb)) is not None:
+            return resp
+
+        resp = self.llm(prompt, **kwargs)
+        if emb is not None:
+            self._store(kind, match, resp, emb)
+        return resp
+
+    def stream(self, prompt: str, kind: str = None, match: str = None, **kwargs):
+        """Same as calling, but yields the response in chunks as they are generated (if the LLM supports streaming)."""
+        if (emb := self._embed(match)) is not None and (resp := self._lookup(kind, emb)) is not None:
+            yield resp
+            return
+
+        if hasattr(self.llm, 'stream'):
+            chunks = []
+            for chunk in self.llm.stream(prompt, **kwargs):
+                chunk = getattr(chunk, 'content', chunk) # chat models stream message chunks
+                chunks.append(chunk)
+                yield chunk
+            resp = ''.join(chunks)
+        else:
+            resp = self.llm(prompt, **kwargs)
+            yield resp
+        if emb is not None:
+            self._store(kind, match, resp, emb)
+
+    def dump(self) -> dict:
+        """Returns the cache as a JSON serializable dict ({key: [kind, response, embedding]}), which can be passed to `load` later."""
+        return {
+            key: [kind, resp, emb]
+            for kind, (keys, responses, embeddings) in self.caches.items()
+            for key, resp, emb in zip(keys, responses, embeddings.tolist())
+        }
+
+    def load(self, saved: dict):
+        if self.embedder is None:
+            return
+        for key, entry in saved.items():
+            if len(entry) == 3: # older entries had no kind, and embedded the whole prompt, so can't be reused
+                kind, resp, emb = entry
+                keys, responses, embeddings = self.caches.setdefault(kind, [[], [], np.empty((0, self.EMBED_DIM), dtype=np.float32)])
+                keys.append(key)
+                responses.append(resp)
+                self.caches[kind][2] = np.vstack([embeddings, np.asarray(emb, dtype=np.float32)])
 
 class TaskManager(object):
     """Task Manager"""
-    current_tasks: list = []
+    __slots__ = (
+        'final_goal', 'tools', 'verbose', 'llm', 'draft_llm', 'output_func', 'complete_func', 'input_func', 'allow_repeat_tasks', 'confirm_tool',
+        'current_tasks', 'final_result', 'stored_info', 'completed_tasks', 'goal_completed', 'persist', 'checkpoint_interval', '_result_path', '_last_checkpoint',
+        '_tools_str', '_static_prefix_str', '_prompt_cache', '_summary_cache', '_results_cas', '_log_fd', '_log_size', '_snapshot_size', '_tool_runs', '_lock'
+    )
+    current_tasks: list
     final_goal: str
-    goal_completed: bool = False
+    goal_completed: bool
     tools: list
-    verbose: bool = True
-    llm: BaseLLM
-    final_result: dict = {}
-    stored_info: dict = {}
-    persist: str = None
-    completed_tasks: dict = {}
-    BASE_PROMPT: str = """
+    verbose: bool
+    llm: CachingLLM
+    draft_llm: CachingLLM
+    final_result: dict
+    stored_info: dict
+    persist: str
+    COMPACT_RATIO: int = 4 # rewrite the persist snapshot once its log is this many times bigger than it
+    MMAP_MIN_SIZE: int = 65536 # persist snapshots bigger than this are parsed straight from a memory map (with orjson)
+    CONTEXT_MAX_CHARS: int = 4000 # stored_info/completed_tasks bigger than this (as JSON) get summarized in prompts
+    CONTEXT_KEEP: int = 8 # number of most recent entries never summarized, older ones are summarized in blocks of this size
+    SUMMARY_KEY: str = '_summary' # reserved key the summary of older entries is put under, never taken from the LLM's stored_info
+    completed_tasks: dict # task: result hash, see `_complete_task`
+    STATIC_PROMPT: Template = Template("""
     You are a task management system. Your job is to create, reformulate, and refine a set of tasks. The tasks must be focused on achieving your final goal. It is very important you keep the final goal in mind as you think. Your goal is a constant, throughout, and will never change. 
     As tasks are completed, update your stored info with any info you will need to output at the end. As you go, add on to your final result. Your final result will be returned once, either, you cannot come up with any more reasonable tasks and all are complete, or your final result satisfies your final goal. 
     The language models assigned to your tasks will have access to a list of tools available. As language models, you cannot interact with the internet, however the following tools have been made available so that the final goal can be met. As the tasks you create will be given to other agents, make sure to be specific with each tasks instructions.
 
     Tools
     -----
-    {tools_str}
+    $tools_str
     -----
 
     Final Goal
     ----------
-    {final_goal}
+    $final_goal
     ----------
-
+    """)
+    STATE_PROMPT: Template = Template("""
     Current values
     --------------
-    current_tasks: {current_tasks}
-    stored_info: {stored_info}
-    final_result: {final_result}
+    current_tasks: $current_tasks
+    stored_info: $stored_info
+    final_result: $final_result
     --------------
-    """
+    """)
     ENSURE_COMPLETE_PROMPT: str = '''
     Based on your current values, assess whether you have completed your final_goal. Respond with a dictionary in valid JSON format with the following keys:
     "final_result" - dict - reformat your final result to better meet your final goal,
@@ -62,11 +319,11 @@ class TaskManager(object):
 
     You always give your responses in VALID, JSON READABLE FORMAT.
     '''
-    REFINE_PROMPT: str = '''
+    REFINE_PROMPT: Template = Template('''
     Task Result
     -----------
-    task: {task}
-    result: {result}
+    task: $task
+    result: $result
     -----------
     
     Refine your current set of tasks based on the task result above. E.g., if information has already been gathered that satisfies the requests in a task, it is not needed anymore. However, if information gathered shows a new task needs to be added, include it.
@@ -74,59 +331,147 @@ class TaskManager(object):
     If the result included any info you may need to satisfy your final goal, add it to the final result. Format it as necessary, but make sure it includes all information needed.
     You always give your response in valid JSON format so that it can be parsed (in python) with `json.loads`. Return a dictionary with the keys: "current_tasks" a list of strings (your complete set of tasks, if you need to, add any new tasks and reorder as you see fit), "final_result" a dict (your final result to satisfy your final goal, add to this as you go), "stored_info" a dict (info you may need for later tasks), if you have any thoughts to output to the user, include them as a string with the key "thoughts", and lastly, the key "goal_complete" should contain a boolean value True or False indicating if the final goal has been reached. 
     Make sure your list of tasks ends with a final task like "show results and terminate".
-    '''
-    TASK_PROMPT = '''
-    You are one of many language models working on the same final goal: {final_goal}.
+    ''')
+    TASK_PROMPT: Template = Template('''
+    You are one of many language models working on the same final goal: $final_goal.
 
-    Here is the list of tasks after yours needed to achieve this: {current_tasks}. Your job is to complete this one task: {task}.
+    Here is the list of tasks after yours needed to achieve this: $current_tasks. Your job is to complete this one task: $task.
 
-    Here is some context from previous task results: {combined_info}. 
+    Here is some context from previous task results: $combined_info. 
 
-    {task}
-    '''
+    $task
+    ''')
     CREATE_PROMPT: str = 'Based on your end goal, come up with a list of tasks (in order) that you will need to take to achieve your goal.\nGive your response in valid JSON format so that it can be parsed (in python) with `json.loads`. Return a dictionary with the key "current_tasks" containing a list of strings. Make sure your list of tasks ends with a final step such as "show results and terminate".'
-    FIX_JSON_PROMPT: str = """
+    FIX_JSON_PROMPT: Template = Template("""
     Reformat the following JSON without losing content so that it can be loaded without errors in python using `json.loads`. The following output returned an error when trying to parse. Make sure your response doesn't contain things like: new lines, tabs. Make sure your response uses double quotes as according to the JSON spec. Your response must include an ending quote and ending bracket as needed. ONLY RETURN VALID JSON WITHOUT FORMATTING. 
 
-    Example of valid JSON: {example}
+    Example of valid JSON: $example
 
-    Bad JSON: {bad_json}
+    Bad JSON: $bad_json
 
-    Error: {err}
+    Error: $err
 
-    Good JSON: """
+    Good JSON: """)
+    SUMMARIZE_PROMPT: Template = Template('''
+    Summarize the following info (JSON) as briefly as possible. Keep every detail that may be needed for later tasks, e.g. names, hosts, IPs, ports, versions, credentials, file paths, and findings. Only respond with the summary.
+
+    $info
+    ''')
+    INDEPENDENT_TASKS_PROMPT: Template = Template('''
+    The following tasks will be done in order. For each task, decide whether it could be done right now, at the same time as the tasks before it, without needing anything they find or produce (e.g. it doesn't refer to services, hosts, files, or results that earlier tasks will identify).
+    If unsure, assume it depends on them. Respond with a dictionary in valid JSON format with the key "independent" containing a list of the numbers of the tasks that don't depend on earlier tasks.
+
+    $tasks
+    ''')
     GOOD_JSON_EXAMPLE: str = '''{"current_tasks": ["Research Amjad Masad's career and background.", "Create a CSV called \"career.csv\" and write his careers to it."], "stored_info": {"username": "amasad"}, "thoughts": "I will research his career and background, and then save the results to \"career.csv\"."}'''
 
     def _make_tools_str(self, tools: list) -> str:
-        """Tools should be a list of dictionaries with the keys: "name" and "description"."""
+        """Tools should be a list (or any iterable, e.g. `iter_langchain_tools`) of dictionaries with the keys: "name" and "description"."""
         return '-----\n'.join(['\n'.join([f'{k}: {v}' for k, v in tool.items()]) for tool in tools]) # the fn name has an _ so it doesn't have to be readable, right?
 
+    @property
+    def tools_str(self) -> str:
+        """The tools formatted for prompts. Only built when first needed, e.g. not when all tasks are loaded from persist and none are run."""
+        if self._tools_str is None:
+            self._tools_str = self._make_tools_str(self.tools)
+        return self._tools_str
+
+    @property
+    def _static_prefix(self) -> str:
+        if self._static_prefix_str is None:
+            self._static_prefix_str = self.STATIC_PROMPT.substitute(
+                tools_str = self.tools_str,
+                final_goal = self.final_goal
+            )
+        return self._static_prefix_str
+
     def _load_persist(self):
         if os.path.exists(self.persist):
-            with open(self.persist, 'r') as f:
-                saved = json.load(f)
+            with open(self.persist, 'rb') as f:
+                if orjson is not None and os.fstat(f.fileno()).st_size > self.MMAP_MIN_SIZE: # parse without copying the file into memory first
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                        saved = orjson.loads(view)
+                else:
+                    saved = _loads(f.read())
             self.output_func(f'[system] Loaded stored info from: {self.persist}')
         else:
             saved = {}
             self.output_func(f'[system] Could not read {self.persist}, assuming new file. It will be created later.')
+        self._snapshot_size = os.path.getsize(self.persist) if saved else 0
+        log = self.persist + '.log'
+        if os.path.exists(log): # replay changes made since the last snapshot
+            with open(log, 'rb') as f:
+                for line in f:
+                    try:
+                        delta = _loads(line)
+                    except json.JSONDecodeError:
+                        break # last write was cut off
+                    if delta['key'] is None:
+                        saved[delta['k']] = delta['v']
+                    else:
+                        saved.setdefault(delta['k'], {})[delta['key']] = delta['v']
+        self._log_fd = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        self._log_size = os.fstat(self._log_fd).st_size
+        atexit.register(os.close, self._log_fd)
+
         self.stored_info = saved.get('stored_info', {})
+        if (tools_used := saved.get('tools_used')): # logged one call at a time (key = index), see `_log_tool`
+            entries = self.stored_info.setdefault('tools_used', [])
+            for i, entry in sorted(tools_used.items()):
+                entries.extend({} for _ in range(i + 1 - len(entries)))
+                entries[i] = entry
         self.final_result = saved.get('final_result', {})
-        self.current_tasks = saved.get('current_tasks', [])
-        self.completed_tasks = saved.get('completed_tasks', {})
-    def _save_persist(self):
-        with open(self.persist, 'w') as f:
-            json.dump({
-                'stored_info': self.stored_info,
-                'final_result': self.final_result,
-                'current_tasks': self.current_tasks,
-                'completed_tasks': self.completed_tasks
-            }, f)
+        self.current_tasks = _intern_tasks(saved.get('current_tasks', []))
+        self._results_cas = saved.get('results_cas', {})
+        self.completed_tasks = {}
+        for task, result_hash in saved.get('completed_tasks', {}).items():
+            if result_hash in self._results_cas:
+                self.completed_tasks[sys.intern(task)] = result_hash
+            else: # saved before results were stored by hash
+                self._complete_task(task, result_hash)
+        self.llm.load(saved.get('llm_cache', {}))
+        if self.draft_llm is not self.llm:
+            self.draft_llm.load(saved.get('draft_llm_cache', {}))
+        self._prompt_cache.update({base64.b64decode(k): v for k, v in saved.get('prompt_cache', {}).items()})
+
+    def _append_delta(self, kind: str, key, value):
+        """
+        Saves a single change to the persist log, if persist is set. Replayed on top of the snapshot by `_load_persist`.
+
+        :param kind: str - name of the saved value, e.g. "stored_info"
+        :param key: str - key within that dict to set, or None to replace the whole value
+        :param value: any - new value (must be JSON serializable)
+        """
+        if not self.persist:
+            return
+        line = _dumps({'k': kind, 'key': key, 'v': value}) + b'\n'
+        with self._lock:
+            os.write(self._log_fd, line)
+            self._log_size += len(line)
+            if self._log_size > self.COMPACT_RATIO * self._snapshot_size:
+                self._compact_persist()
+
+    def _compact_persist(self):
+        """Writes everything to a new snapshot at `self.persist` and empties the log."""
+        _write_atomic(self.persist, _dumps({
+            'stored_info': self.stored_info,
+            'final_result': self.final_result,
+            'current_tasks': self.current_tasks,
+            'completed_tasks': self.completed_tasks,
+            'results_cas': self._results_cas,
+            'llm_cache': self.llm.dump(),
+            'draft_llm_cache': self.draft_llm.dump() if self.draft_llm is not self.llm else {},
+            'prompt_cache': {base64.b64encode(k).decode(): v for k, v in self._prompt_cache.items()}
+        }))
+        os.ftruncate(self._log_fd, 0) # replaying the log over the new snapshot is harmless, so a crash before this is fine too
+        self._snapshot_size = os.path.getsize(self.persist)
+        self._log_size = 0
         self.output_func(f'saved stored info to: {self.persist}')
-    
-    def __init__(self, goal: str, tools: list, llm: BaseLLM, verbose: bool = True, output_func: callable = print, complete_func: callable = save_to_file, input_func: callable = input, current_tasks: list = None, final_result: dict = None, allow_repeat_tasks: bool = True, completed_tasks: dict = None, persist: str = None, confirm_tool: bool = False):
+
+    def __init__(self, goal: str, tools: list, llm: BaseLLM, verbose: bool = True, output_func: callable = print, complete_func: callable = save_to_file, input_func: callable = input, current_tasks: list = None, final_result: dict = None, allow_repeat_tasks: bool = True, completed_tasks: dict = None, persist: str = None, confirm_tool: bool = False, semantic_cache: bool = False, draft_llm: BaseLLM = None, checkpoint_interval: float = None):
         """
         :param goal: str - final goal in natural language
-        :param tools: list - a list of tools (dicts) containing keys "name" and "description"
+        :param tools: list - a list (or any iterable, e.g. `iter_langchain_tools`, which is only read once) of tools (dicts) containing keys "name" and "description"
         :param llm: BaseLLM - LLM instance from langchain.llms
 
         :kwarg verbose: bool - defaults to True, if False, will not print updated info
@@ -136,6 +481,9 @@ class TaskManager(object):
         :kwarg complete_func: callable - func to run when complete, accepts a goal (str) and results (dict), defaults to a func that saves to file
         :kwarg persist: str - defaults to None, but if set to a filepath, [stored_info, final_result, current_tasks] will be loaded and saved there
         :kwarg confirm_tool: bool - require user confirmation before running tools (default: False)
+        :kwarg semantic_cache: bool - defaults to False, if True will reuse LLM responses for similar prompts (requires sentence-transformers). Only used for creating tasks and refining, and only when the goal plus task and result are short (see `CachingLLM`)
+        :kwarg draft_llm: BaseLLM - defaults to None (use llm), a smaller/faster LLM used for simple prompts (checking the goal is complete, fixing JSON)
+        :kwarg checkpoint_interval: float - defaults to None (disabled), if set, the results so far are saved to the result file at most this often (in seconds) after each task
         :kwarg completed_tasks: dict - defaults to None for empty, already completed tasks for when allow_repeat_tasks=False (key = task name, value = task result), overwrites loaded tasks
         :kwarg current_tasks: list - defaults to None for empty, contains a list of (strings) tasks in natural language, overwrites loaded tasks
         :kwarg final_result: dict - defaults to None for empty, contains a dict of any results for the final goal, overwrites loaded result
@@ -145,7 +493,13 @@ class TaskManager(object):
         if not llm:
             llm = OpenAI(model_name="gpt-3.5-turbo")
         
-        self.llm = llm
+        self.llm = CachingLLM(llm, semantic=semantic_cache)
+        self.draft_llm = CachingLLM(draft_llm, semantic=semantic_cache, embedder=self.llm.embedder) if draft_llm else self.llm # separate cache, as responses from one model shouldn't be returned for the other
+        self._prompt_cache: dict[bytes, str] = {}
+        self._results_cas: dict[str, str] = {} # result hash: result, completed_tasks values are keys to this
+        self._summary_cache: dict[bytes, str] = {} # hash of summarized entries: summary
+        self._tool_runs: dict = {} # run_id of running tools: index in stored_info['tools_used']
+        self._lock = threading.RLock() # tool callbacks may run in other threads, guards tools_used and the persist log
         self.final_goal = goal
         self.tools = tools
         self.output_func = output_func
@@ -154,16 +508,34 @@ class TaskManager(object):
         self.allow_repeat_tasks = allow_repeat_tasks
         self.confirm_tool = confirm_tool
         self.verbose = verbose
+        self.checkpoint_interval = checkpoint_interval
+        self._result_path = _result_filename(goal)
+        self._last_checkpoint = time.monotonic()
+        self._tools_str = None # built on first use, see `tools_str`
+        self._static_prefix_str = None
+        self.current_tasks = []
+        self.final_result = {}
+        self.stored_info = {}
+        self.completed_tasks = {}
+        self.goal_completed = False
+        self.persist = persist
         if persist:  # load from file
-            self.persist = persist
             self._load_persist()
+            self.llm.on_store = lambda kind, key, resp, emb: self._append_delta('llm_cache', key, [kind, resp, emb.tolist()])
+            if self.draft_llm is not self.llm:
+                self.draft_llm.on_store = lambda kind, key, resp, emb: self._append_delta('draft_llm_cache', key, [kind, resp, emb.tolist()])
         # overwrite from kwargs
         if current_tasks:
-            self.current_tasks = current_tasks
+            self.current_tasks = _intern_tasks(current_tasks)
+            self._append_delta('current_tasks', None, current_tasks)
         if final_result:
             self.final_result = final_result
+            self._append_delta('final_result', None, final_result)
         if completed_tasks:
-            self.completed_tasks = completed_tasks
+            self.completed_tasks = {}
+            self._append_delta('completed_tasks', None, {})
+            for task, result in completed_tasks.items():
+                self._complete_task(task, result)
         
 
         if not self.current_tasks:  # if no loaded tasks
@@ -190,24 +562,154 @@ class TaskManager(object):
         else:
             combined_info = {'final_result': self.final_result, 'stored_info': self.stored_info}
         if include_completed_tasks:
-            combined_info['completed_tasks'] = self.completed_tasks
+            combined_info['completed_tasks'] = self._compact_context(self._completed_results())
         
-        return self.TASK_PROMPT.format(
+        return self.TASK_PROMPT.substitute(
             task=task, # task for agent, the rest is context
             current_tasks=self.current_tasks,
             final_goal=self.final_goal,
             combined_info=combined_info
         )
 
-    def _base(self):
-        return self.BASE_PROMPT.format(
-            tools_str = self._make_tools_str(self.tools),
-            final_goal = self.final_goal,
+    def _prompt_key(self, prompt: str, llm: CachingLLM = None) -> bytes:
+        # the draft LLM's responses are keyed separately, so they're never replayed for the main LLM (or vice versa)
+        return hashlib.blake2b(prompt.encode(), digest_size=16, person=b'draft' if llm is not None and llm is not self.llm else b'').digest()
+
+    def _llm(self, prompt: str, draft: bool = False, kind: str = None, match: str = None) -> str:
+        """
+        Calls the LLM (or the draft LLM), replaying the previous response if this exact prompt has been sent before (deterministic LLMs only).
+        kind and match are passed to `CachingLLM` for semantic caching.
+        """
+        llm = self.draft_llm if draft else self.llm
+        if not llm.deterministic:
+            return llm(prompt, kind=kind, match=match)
+        key = self._prompt_key(prompt, llm)
+        if (resp := self._prompt_cache.get(key)) is None:
+            resp = self._prompt_cache[key] = llm(prompt, kind=kind, match=match)
+            self._append_delta('prompt_cache', base64.b64encode(key).decode(), resp)
+        return resp
+
+    def _stream(self, prompt: str, draft: bool = False, kind: str = None, match: str = None):
+        """Same as `_llm`, but yields the response in chunks as it is generated."""
+        llm = self.draft_llm if draft else self.llm
+        if not llm.deterministic:
+            yield from llm.stream(prompt, kind=kind, match=match)
+            return
+        key = self._prompt_key(prompt, llm)
+        if (resp := self._prompt_cache.get(key)) is not None:
+            yield resp
+            return
+        chunks = []
+        for chunk in llm.stream(prompt, kind=kind, match=match):
+            chunks.append(chunk)
+            yield chunk
+        self._prompt_cache[key] = resp = ''.join(chunks)
+        self._append_delta('prompt_cache', base64.b64encode(key).decode(), resp)
+
+    def _parse_stream(self, stream, on_member: callable = None) -> dict:
+        """
+        Parses a JSON object from a stream of text chunks as they arrive. Uses `self.load_json` (so the LLM can fix it) if the stream isn't valid JSON.
+
+        :param stream: iterable - chunks of text, e.g. from `self._stream`
+        :kwarg on_member: callable - called with (key, value) as soon as each top-level key has been parsed
+        """
+        chunks = []
+        def record():
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+
+        res = {}
+        try:
+            for key, value in _iter_json_members(record()):
+                res[key] = value
+                if on_member:
+                    on_member(key, value)
+        except json.JSONDecodeError:
+            pass
+        else:
+            return res
+        finally:
+            chunks.extend(stream) # read whatever's left, so the stream can finish (and be cached)
+
+        fixed = self.load_json(''.join(chunks))
+        if on_member:
+            for key, value in fixed.items():
+                if res.get(key) != value: # don't apply keys twice
+                    on_member(key, value)
+        return fixed
+
+    def _state(self) -> str:
+        """The current values part of the prompt."""
+        return self.STATE_PROMPT.substitute(
             current_tasks = self.current_tasks,
             final_result = self.final_result,
-            stored_info=self.stored_info
+            stored_info=self._compact_context(self.stored_info)
         )
 
+    def _prompt(self, action: str, state: str = None) -> str:
+        """Builds a prompt from the static prefix, the current values (`state`, defaults to `self._state()`), and then `action` (e.g. `self.CREATE_PROMPT`)."""
+        # the static prefix never changes, so it goes first to keep it cacheable (by the provider as well as us)
+        return ''.join((self._static_prefix, state if state is not None else self._state(), action))
+
+    def _compact_context(self, info: dict) -> dict:
+        """
+        Returns info as is if it's small enough (see `CONTEXT_MAX_CHARS`), otherwise keeps the most recent entries and replaces older ones with a summary, so prompts don't keep growing with every task.
+        Long lists (e.g. tools_used) are compacted first, then the keys of info itself, then any values that are still too big (see `_fit`). Doesn't change info itself.
+        """
+        if len(_dumps(info)) <= self.CONTEXT_MAX_CHARS:
+            return info
+        info = {k: self._compact_list(v) if type(v) == list else v for k, v in info.items()}
+        if len(_dumps(info)) <= self.CONTEXT_MAX_CHARS:
+            return info
+        items = list(info.items())
+        if (n_old := self._n_old(items)):
+            info = {self.SUMMARY_KEY: self._summarize(items[:n_old], dict), **dict(items[n_old:])}
+        return self._fit(info)
+
+    def _fit(self, info: dict) -> dict:
+        """
+        Makes sure info fits in `CONTEXT_MAX_CHARS`, even if a single value (e.g. a long tool output) is bigger than that.
+        Each value (or entry, for lists) gets an equal share of what the smaller ones leave, and anything bigger is summarized, then truncated if the summary is still too long.
+        """
+        if len(_dumps(info)) <= self.CONTEXT_MAX_CHARS:
+            return info
+        sizes = sorted(len(_dumps(v)) for value in info.values() for v in (value if type(value) == list else [value]))
+        budget = self.CONTEXT_MAX_CHARS - len(_dumps({k: [0] * len(v) if type(v) == list else 0 for k, v in info.items()})) # minus keys, brackets, etc.
+        for n_left, size in zip(range(len(sizes), 0, -1), sizes):
+            if size > (cap := budget // n_left):
+                break
+            budget -= size
+        shrink = lambda v: v if len(block := _dumps(v)) <= cap else self._summary(block)[:max(cap - 2, 0)] # - 2 for the quotes
+        return {k: [*map(shrink, v)] if type(v) == list else shrink(v) for k, v in info.items()}
+
+    def _compact_list(self, entries: list) -> list:
+        """Same as `_compact_context`, but for a list, the summary is the first entry."""
+        if not (n_old := self._n_old(entries)):
+            return entries
+        return [{self.SUMMARY_KEY: self._summarize(entries[:n_old], list)}, *entries[n_old:]]
+
+    def _n_old(self, entries: list) -> int:
+        """
+        Number of older entries to summarize: all but the last `CONTEXT_KEEP`, or more if the rest are still bigger than `CONTEXT_MAX_CHARS` (e.g. long tool outputs).
+        Whole blocks only, so they stay the same (and cached) as more are added.
+        """
+        n_old = max(len(entries) - self.CONTEXT_KEEP, 0) // self.CONTEXT_KEEP * self.CONTEXT_KEEP
+        while n_old + self.CONTEXT_KEEP < len(entries) and len(_dumps(entries[n_old:])) > self.CONTEXT_MAX_CHARS:
+            n_old += self.CONTEXT_KEEP
+        return n_old
+
+    def _summarize(self, entries: list, container: type) -> str:
+        """Summarizes entries in blocks of `CONTEXT_KEEP` (each dumped as container, e.g. dict for items). Summaries are cached by content, so each block is only summarized once."""
+        return '\n'.join(self._summary(_dumps(container(entries[i:i + self.CONTEXT_KEEP]))) for i in range(0, len(entries), self.CONTEXT_KEEP))
+
+    def _summary(self, block: bytes) -> str:
+        """Summary of block (JSON), cached by content."""
+        key = hashlib.blake2b(block, digest_size=16).digest()
+        if (summary := self._summary_cache.get(key)) is None:
+            summary = self._summary_cache[key] = self._llm(self.SUMMARIZE_PROMPT.substitute(info=block.decode()), draft=True).strip()
+        return summary
+
     def fix_json(self, bad_json: str, err: Exception = None, retry: int = 1) -> dict:
         """
         Uses the LLM to try fix JSON response. Prompt: `self.FIX_JSON_PROMPT`
@@ -218,9 +720,9 @@ class TaskManager(object):
         """
         
         self.output_func(f'[system] fixing ai JSON output ({retry} retries left)...')
-        resp = self.llm(self.FIX_JSON_PROMPT.format(bad_json=bad_json, err=err, example=self.GOOD_JSON_EXAMPLE))
+        resp = self._llm(self.FIX_JSON_PROMPT.substitute(bad_json=bad_json, err=err, example=self.GOOD_JSON_EXAMPLE), draft=True)
         try:
-            return json.loads(resp.strip())
+            return self._loads_tolerant(resp)
         except json.JSONDecodeError as e:
             self.output_func('[system] cannot parse ai result as JSON: ' + str(e))
             if retry > 0:
@@ -233,7 +735,7 @@ class TaskManager(object):
     def _load_json(self, json_str: str):
         json_str = json_str.replace('\t', '').replace('    ', '').replace('        ', '').replace('\n', '').replace('            ', '').strip()
         try:
-            return True, json.loads(json_str)
+            return True, _loads(json_str)
         except json.JSONDecodeError:
             pass
         if not json_str.endswith('}'):
@@ -241,37 +743,82 @@ class TaskManager(object):
                 json_str += '"' if '"' in json_str else "'"
             json_str += '}'
         try:
-            return True, json.loads(json_str)
+            return True, _loads(json_str)
         except json.JSONDecodeError:
             return False, json_str
             
+    def _loads_tolerant(self, json_str: str) -> dict:
+        """Tries to load (possibly malformed) JSON without using the LLM. Raises json.JSONDecodeError if it can't."""
+        try:
+            return _loads(json_str)
+        except json.JSONDecodeError as e:
+            err = e
+        if (extracted := _extract_json(json_str)) != json_str: # usually just fences or text around valid JSON
+            try:
+                return _loads(extracted)
+            except json.JSONDecodeError:
+                pass
+        if json_repair is not None: # handles trailing commas, single quotes, unescaped newlines, truncated output, etc.
+            if isinstance(repaired := json_repair.loads(extracted), dict):
+                return repaired
+        ok, res = self._load_json(extracted)
+        if ok:
+            return res
+        raise err
+
     def load_json(self, json_str: str, retry: int = 1) -> dict:
         """
         Try loading a json_str, retrying 1 times by default. 
         First tries manually, then uses LLM.
         """
         try:
-            ok, res = self._load_json(json_str) # try fix manually
-            return res if ok else json.loads(res) # trigger err if not ok
+            return self._loads_tolerant(json_str) # try fix manually
         except json.JSONDecodeError as e:
             return self.fix_json(json_str, err=e, retry=retry)
 
     def _create_initial_tasks(self):
         """This gets called during __init__"""
-        prompt = self._base() + self.CREATE_PROMPT
-        resp = self.llm(prompt)
+        state = self._state()
+        resp = self._llm(self._prompt(self.CREATE_PROMPT, state), kind='create', match=self.final_goal)
         res = self.load_json(resp)
 
         if self.verbose:
             self.output_func('[system] ai created task list: ' + ', '.join(res['current_tasks']))
-        self.current_tasks = res['current_tasks']
+        self.current_tasks = _intern_tasks(res['current_tasks'])
+        self._append_delta('current_tasks', None, self.current_tasks)
+
+    def _complete_task(self, task: str, result: str):
+        """Adds to completed_tasks, storing each unique result only once (in `self._results_cas`, by hash)."""
+        result_hash = hashlib.blake2b(result.encode(), digest_size=16).hexdigest()
+        if result_hash not in self._results_cas:
+            self._results_cas[result_hash] = result
+            self._append_delta('results_cas', result_hash, result)
+        self.completed_tasks[sys.intern(task)] = result_hash
+        self._append_delta('completed_tasks', task, result_hash)
+
+    def _completed_results(self) -> dict:
+        """Returns completed_tasks with the actual results (key = task name, value = task result)."""
+        return {task: self._results_cas[result_hash] for task, result_hash in self.completed_tasks.items()}
+
+    def _log_tool(self, i: int):
+        """Saves a single entry of self.stored_info['tools_used'], rather than the whole (ever growing) list."""
+        self._append_delta('tools_used', i, self.stored_info['tools_used'][i])
 
     def _on_tool_start(self, tool, input_str, **kwargs):
         """Set the agent.callback_manager.on_tool_start to this to save tool inputs to self.stored_info['tools_used']."""
-        self.stored_info['tools_used'] = [*self.stored_info.get('tools_used', []), {'tool': tool, 'input': input_str}]
+        with self._lock:
+            tools_used = self.stored_info.setdefault('tools_used', [])
+            i = len(tools_used)
+            tools_used.append({'tool': tool, 'input': input_str})
+            if (run_id := kwargs.get('run_id')) is not None: # tools can run at the same time (see `arun_tasks`), so outputs are matched by run
+                self._tool_runs[run_id] = i
+            self._log_tool(i)
     def _on_tool_end(self, output, **kwargs):
         """Set the agent.callback_manager.on_tool_end to this to save tool outputs to self.stored_info['tool_used']."""
-        self.stored_info['tools_used'][-1]['output'] = output
+        with self._lock:
+            i = self._tool_runs.pop(kwargs.get('run_id'), len(self.stored_info['tools_used']) - 1)
+            self.stored_info['tools_used'][i]['output'] = output
+            self._log_tool(i)
     
     def refine(self, task_name: str, task_result: str):
         """
@@ -280,49 +827,133 @@ class TaskManager(object):
         :param task_name: str - task in natural language
         :param task_result: str - output from agent
         """
-        self.completed_tasks[task_name] = task_result
-        needs_save = False
-        prompt = self._base() + self.REFINE_PROMPT.format(
+        self._complete_task(task_name, task_result)
+        self._refine(self.REFINE_PROMPT.substitute(
             task = task_name,
             result = task_result
-        )
-        resp = self.llm(prompt)
-        res = self.load_json(resp)
+        ), f'{task_name}\n{task_result}')
+
+    def refine_many(self, results: dict):
+        """
+        Same as `refine`, but for several tasks that were run at the same time. Uses a single LLM call for all of them.
+
+        :param results: dict - key = task in natural language, value = output from agent
+        """
+        for task_name, task_result in results.items():
+            self._complete_task(task_name, task_result)
+        self._refine(self.REFINE_PROMPT.substitute(
+            task = list(results),
+            result = results
+        ), str(results))
+
+    def _refine(self, refine_prompt: str, task_result: str):
+        state = self._state()
+        match = f'{self.final_goal}\n{task_result}' # only what differs between refines, and short enough to embed, see `CachingLLM`
+        # tasks, info, and results are applied as soon as they've been generated, rather than waiting for the whole response
+        res = self._parse_stream(self._stream(self._prompt(refine_prompt, state), kind='refine', match=match), on_member=self._apply_refine)
 
         if (err := res.get('error')):
             self.output_func(f'[system] skipping due to error: {err}')
             return
-        
-        if (thoughts := res.get('thoughts')):
-            self.output_func(f'[ai] {thoughts}')
+
         if res.get('goal_complete'):
             self.current_tasks = [] # clear remaining tasks
+            self._append_delta('current_tasks', None, [])
             self.output_func('[system] goal complete')
             self.complete_func(self.final_goal, {
-                'final_result': {**self.final_result, **res['final_result']},
-                'completed_tasks': self.completed_tasks,
+                'final_result': self.final_result,
+                'completed_tasks': self._completed_results(),
                 'stored_info': self.stored_info,
             })
             self.goal_completed = True
 
-        if (current_tasks := res.get('current_tasks')):
-            needs_save = True
-            self.add_tasks(current_tasks)
-        if (stored_info := res.get('stored_info')):
-            needs_save = True
+        if self.checkpoint_interval is not None and not self.goal_completed:
+            self.checkpoint()
+
+    def checkpoint(self, force: bool = False):
+        """
+        Saves the results so far to the result file (the same file `save_to_file` writes when complete), so a crash doesn't lose them.
+        Called after each task if checkpoint_interval is set.
+
+        :kwarg force: bool - defaults to False, if True, saves even if checkpoint_interval seconds haven't passed since the last checkpoint
+        """
+        if not force and time.monotonic() - self._last_checkpoint < (self.checkpoint_interval or 0):
+            return
+        _write_atomic(self._result_path, _dumps({
+            'final_result': self.final_result,
+            'completed_tasks': self._completed_results(),
+            'stored_info': self.stored_info,
+        }))
+        self._last_checkpoint = time.monotonic()
+
+    def _apply_refine(self, key: str, value):
+        """Applies one key of a `self.REFINE_PROMPT` response. Called by `refine` as each key is parsed."""
+        if not value:
+            return
+        if key == 'thoughts':
+            self.output_func(f'[ai] {value}')
+        elif key == 'current_tasks':
+            self.add_tasks(value)
+        elif key == 'stored_info':
+            # the summary is only ever added to prompts, and tools_used by the tool callbacks, so the LLM echoing them back mustn't overwrite anything
+            if not (value := {k: v for k, v in value.items() if k not in (self.SUMMARY_KEY, 'tools_used')}):
+                return
             if self.verbose:
-                self.output_func(f'[system] new info: {stored_info}')
-            self.stored_info.update(stored_info)
-        if (final_result := res.get('final_result')):
-            needs_save = True
+                self.output_func(f'[system] new info: {value}')
+            self.stored_info.update(value)
+            for k, v in value.items():
+                self._append_delta('stored_info', k, v)
+        elif key == 'final_result':
             if self.verbose:
-                self.output_func(f'[system] new final result: {final_result}')
-            self.final_result.update(final_result)
+                self.output_func(f'[system] new final result: {value}')
+            self.final_result.update(value)
+            for k, v in value.items():
+                self._append_delta('final_result', k, v)
 
-        if needs_save and self.persist:
-            self._save_persist()
+    def next_task_batch(self, max_tasks: int = 8) -> list:
+        """
+        Pops the next task from current_tasks, along with any following tasks that don't need earlier results, so they can be run at the same time with `arun_tasks`.
+        Tasks that obviously refer to earlier results (see `_DEPENDENT_TASK_RE`) end the batch, the rest are checked with the draft LLM (`self.INDEPENDENT_TASKS_PROMPT`).
+        Conservative: the batch ends at the first task that isn't marked independent, or if the response can't be parsed.
+
+        :kwarg max_tasks: int - defaults to 8, max number of tasks to return
+        """
+        candidates = []
+        for task in self.current_tasks[1:max_tasks]:
+            if _DEPENDENT_TASK_RE.search(task):
+                break
+            candidates.append(task)
+        n = 1
+        if candidates:
+            tasks = '\n'.join(f'{i}. {task}' for i, task in enumerate(self.current_tasks[:len(candidates) + 1], 1))
+            res = self.load_json(self._llm(self.INDEPENDENT_TASKS_PROMPT.substitute(tasks=tasks), draft=True))
+            independent = {int(i) for i in res.get('independent') or [] if str(i).isdigit()}
+            while n <= len(candidates) and n + 1 in independent:
+                n += 1
+        batch, self.current_tasks = self.current_tasks[:n], self.current_tasks[n:]
+        return batch
+
+    async def arun_tasks(self, tasks: list, run_task: callable, max_concurrency: int = 8, **format_kwargs) -> dict:
+        """
+        Runs independent tasks concurrently, then refines once with all of their results (see `refine_many`). Returns a dict of task: result.
+
+        :param tasks: list - tasks in natural language, e.g. from `next_task_batch`
+        :param run_task: callable - async function that runs a prompt and returns the result. Tasks run at the same time, so each call should use its own agent (and memory), e.g. `lambda prompt: make_agent().arun(prompt)`
+        :kwarg max_concurrency: int - defaults to 8, max number of tasks running at once
+        :kwarg format_kwargs: passed to `format_task_str`
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        async def run(prompt):
+            async with semaphore:
+                return await run_task(prompt)
+
+        prompts = [self.format_task_str(task, **format_kwargs) for task in tasks] # may call the LLM to summarize, so done before any tasks start rather than blocking them
+        results = dict(zip(tasks, await asyncio.gather(*map(run, prompts))))
+        self.refine_many(results)
+        return results
 
     def add_tasks(self, current_tasks: list):
+        current_tasks = _intern_tasks(current_tasks)
         if self.allow_repeat_tasks:
             if self.verbose:
                 self.output_func(f'[system] new tasks: {current_tasks}')
@@ -332,18 +963,20 @@ class TaskManager(object):
             for task in current_tasks:
                 if not task in self.completed_tasks.keys():
                     new_current_tasks.append(task)
-            self.output_func(f'[system] new tasks: {new_current_tasks} (skipped: {", ".join(t for t in new_current_tasks if not t in current_tasks)})')
+            self.output_func(f'[system] new tasks: {new_current_tasks} (skipped: {", ".join(t for t in current_tasks if not t in new_current_tasks)})')
             self.current_tasks = new_current_tasks
+        self._append_delta('current_tasks', None, self.current_tasks)
 
     def ensure_goal_complete(self):
-        prompt = self._base() + self.ENSURE_COMPLETE_PROMPT
-        resp = self.llm(prompt)
-        res = self.load_json(resp)
+        state = self._state()
+        res = self._parse_stream(self._stream(self._prompt(self.ENSURE_COMPLETE_PROMPT, state), draft=True)) # not semantically cached, the answer depends on the exact current values
 
         if (final_result := res.get('final_result')):
             if self.verbose:
                 self.output_func(f'[system] new final result: {final_result}')
             self.final_result.update(final_result)
+            for k, v in final_result.items():
+                self._append_delta('final_result', k, v)
         if (current_tasks := res.get('current_tasks')):
             self.add_tasks(current_tasks)
 
@@ -351,10 +984,11 @@ class TaskManager(object):
             self.output_func('[system] Goal completed!')
             self.complete_func(self.final_goal, {
                 'final_result': self.final_result,
-                'completed_tasks': self.completed_tasks,
+                'completed_tasks': self._completed_results(),
                 'stored_info': self.stored_info,
             })
             self.current_tasks = []
+            self._append_delta('current_tasks', None, [])
             self.goal_completed = True
             return True
         else:
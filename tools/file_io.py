@@ -1,6 +1,7 @@
 from langchain.tools import BaseTool
 import json
 import os
+import asyncio
 
 class WriteFileTool(BaseTool):
     name = 'WriteFileTool'
@@ -36,7 +37,7 @@ class WriteFileTool(BaseTool):
         return filename
 
     async def _arun(self, args):
-        return self._run(args)
+        return await asyncio.to_thread(self._run, args)
 
 class ReadFileTool(BaseTool):
     name = 'ReadFileTool'
@@ -54,7 +55,7 @@ class ReadFileTool(BaseTool):
             return f'Error: cannot open file: {filename}'
         return file.read()
     async def _arun(self, filename):
-        return self._run(filename)
+        return await asyncio.to_thread(self._run, filename)
 
 class ListDirTool(BaseTool):
     name = 'ListDirTool'
@@ -71,4 +72,4 @@ class ListDirTool(BaseTool):
             return f'Error: cannot list directory: {path}'
     
     async def _arun(self, path):
-        return self._run(path)
\ No newline at end of file
+        return await asyncio.to_thread(self._run, path)
\ No newline at end of file
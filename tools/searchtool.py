@@ -1,6 +1,7 @@
 from langchain.tools import BaseTool
 from googlesearch_py import search
 from duckduckgo_search import ddg
+import asyncio
 
 class GoogleSearchTool(BaseTool):
     name = "GoogleSearch"
@@ -11,7 +12,7 @@ class GoogleSearchTool(BaseTool):
         #return [str(res) for res in search(query)]
 
     async def _arun(self, query: str) -> list:
-        return self._run(query)
+        return await asyncio.to_thread(self._run, query)
 
 class DDGSearchTool(BaseTool):
     name = 'DuckDuckGo'
@@ -26,4 +27,4 @@ class DDGSearchTool(BaseTool):
         return ddg(query)
     
     async def _arun(self, query: str) -> list:
-        return self._run(query)
\ No newline at end of file
+        return await asyncio.to_thread(self._run, query)
\ No newline at end of file
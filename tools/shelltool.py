@@ -2,6 +2,8 @@ from langchain.tools import BaseTool
 from subprocess import Popen, PIPE
 from pydantic import Field
 import platform
+import asyncio
+from .user_io import INPUT_LOCK
 
 class ShellTool(BaseTool):
     name = 'RunCommand'
@@ -31,9 +33,11 @@ class ShellTool(BaseTool):
 
     def _run(self, command: str) -> str:
         if self.confirm_before_exec:
-            conf = self.input(f'[system] run the following command? `{command}`. [y]es/[N]o/[e]dit: ').lower()
+            with INPUT_LOCK:
+                conf = self.input(f'[system] run the following command? `{command}`. [y]es/[N]o/[e]dit: ').lower()
+                if conf.startswith('e'):
+                    new = self.input('enter new command: ')
             if conf.startswith('e'):
-                new = self.input('enter new command: ')
                 return self._sh(new)
             elif conf.startswith('y'):
                 return self._sh(command)
@@ -43,4 +47,4 @@ class ShellTool(BaseTool):
                     'stderr':'User aborted the process before command was executed. Reformulate.'        
                 }
     async def _arun(self, command):
-        return self._run(command)
\ No newline at end of file
+        return await asyncio.to_thread(self._run, command)
\ No newline at end of file
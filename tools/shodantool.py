@@ -1,6 +1,7 @@
 from langchain.tools import BaseTool
 from langchain.tools.base import Field
 import os
+import asyncio
 try:
     from shodan import Shodan
 except ImportError:
@@ -29,4 +30,4 @@ class ShodanTool(BaseTool):
             return f'Error: {str(e)}'
         return res['matches']
     async def _arun(self, query):
-        return self._run(query)
\ No newline at end of file
+        return await asyncio.to_thread(self._run, query)
\ No newline at end of file
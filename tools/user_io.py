@@ -1,4 +1,8 @@
 from langchain.tools import BaseTool
+import threading
+import asyncio
+
+INPUT_LOCK = threading.Lock() # tools can run in parallel (in threads), so only one of them asks the user at a time
 
 class TalkToUser(BaseTool):
     name = 'TalkToUser'
@@ -11,7 +15,8 @@ class TalkToUser(BaseTool):
     )
 
     def _run(self, message: str) -> str:
-        print(f'[ai: question]: {message}')
-        return input('[user response]: ')
+        with INPUT_LOCK:
+            print(f'[ai: question]: {message}')
+            return input('[user response]: ')
     async def _arun(self, message):
-        return self._run(message)
\ No newline at end of file
+        return await asyncio.to_thread(self._run, message)
\ No newline at end of file
@@ -2,6 +2,7 @@ from langchain.tools import BaseTool
 from pydantic import Field
 from bs4 import BeautifulSoup
 import requests, os
+import asyncio
 
 class ScrapeTool(BaseTool):
     name: str = Field(default="ScrapeTool")  # Explicitly typed
@@ -21,7 +22,7 @@ class ScrapeTool(BaseTool):
         return self.scrape_website(url)
 
     async def _arun(self, url: str) -> str:
-        return self._run(url)
+        return await asyncio.to_thread(self._run, url)
 
 class WebReadTool(BaseTool):
     name: str = Field(default="WebsiteReader")  # Explicitly typed
@@ -49,4 +50,4 @@ class WebReadTool(BaseTool):
         return text
 
     async def _arun(self, url: str) -> str:
-        return self._run(url)
+        return await asyncio.to_thread(self._run, url)